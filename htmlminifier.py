@@ -77,9 +77,15 @@ class HtmlMinifier(object):
 	__buffer = []
 	__stackNoTrimWhitespace = []
 	__stackNoCollapseWhitespace = []
-	__currentChars = ''
+	__currentChars = []
 	__currentTag = ''
 	__opener = None
+
+	# Low-memory mode state. (see minify_stream)
+	__sink = None
+	__depth = 0
+	__resultsSize = 0
+	__maxBuffer = 1 << 20
 	
 	# Cached regex instances
 	reBlank = re.compile(r"^\s*$")
@@ -347,7 +353,7 @@ class HtmlMinifier(object):
 		tag = tag.lower()
 		self.__currentTag = tag
 		self.__currentAttrs = attrs
-		self.__currentChars = ''
+		self.__currentChars = []
 
 		# White space management
 		if self.opts['collapseWhitespace']:
@@ -357,6 +363,8 @@ class HtmlMinifier(object):
 			if not self.__canCollapseWhitespace(tag):
 				self.__stackNoCollapseWhitespace.append(tag)
 
+		self.__depth += 1
+
 		# Add to buffer
 		self.__buffer.append('<')
 		self.__buffer.append(tag)
@@ -365,8 +373,10 @@ class HtmlMinifier(object):
 		self.__buffer.append('>')
 
 	def end(self, tag):
+		self.__depth -= 1
+
 		# Process all of the collected text data
-		text = self.__currentChars
+		text = ''.join(self.__currentChars)
 		if self.__currentTag == 'script':
 			text = self._handle_cdata(text)
 			if self.opts['minifyJS'] and not HtmlMinifier.reBlank.match(text):
@@ -377,7 +387,6 @@ class HtmlMinifier(object):
 			if self.opts['minifyCSS'] and not HtmlMinifier.reBlank.match(text):
 				text = HtmlMinifier.cssmin(text)
 		
-		self.__currentChars = text
 		self.__buffer.append(text)
 		
 		if self.opts['collapseWhitespace']:
@@ -387,24 +396,30 @@ class HtmlMinifier(object):
 			if len(self.__stackNoCollapseWhitespace) and tag == self.__stackNoCollapseWhitespace[len(self.__stackNoCollapseWhitespace) - 1]:
 				self.__stackNoCollapseWhitespace.pop()
 
-		isElementEmpty = self.__currentChars == '' and tag == self.__currentTag
+		isElementEmpty = text == '' and tag == self.__currentTag
 		if self.opts['removeEmptyElements'] and isElementEmpty and self.__canRemoveElement(tag):
 			self.__buffer.reverse()
 			lastIndexOf = len(self.__buffer) -1 - self.__buffer.index('<')
 			self.__buffer.reverse()
 			self.__buffer = self.__buffer[lastIndexOf:]
-			return
 		elif self.opts['removeOptionalTags'] and self.__isOptionalTag(tag):
-			return
+			# No closing tag to add, but still move what we've got over to
+			# the results so it counts toward the buffer cap. Otherwise a
+			# long run of <option>s or <tr>s would pile up in the buffer.
+			self.__pushBuffer()
 		else:
 			self.__buffer.append('</')
 			self.__buffer.append(tag.lower())
 			self.__buffer.append('>')
-			for c in self.__buffer: self.__results.append(c)
-			#self.__results.extend(self.__buffer)
+			self.__pushBuffer()
+			self.__currentChars = []
 
-		self.__buffer = []
-		self.__currentChars = ''
+		# In low-memory mode, hand off everything collected so far once a
+		# top-level subtree (a child of <html> or <body>) is complete or
+		# we've gone over our buffer cap.
+		if self.__sink is not None and \
+		   (self.__depth <= 2 or self.__resultsSize >= self.__maxBuffer):
+			self.__flushResults()
 
 	def data(self, text):
 		""" Process an element's inner text """
@@ -415,7 +430,7 @@ class HtmlMinifier(object):
 			if not len(self.__stackNoCollapseWhitespace) and self.__canCollapseWhitespace(self.__currentTag):
 				text = self.__collapseWhitespace(text)
 
-		self.__currentChars += text
+		self.__currentChars.append(text)
 
 	def comment(self, text):
 		if self.opts['removeComments']:
@@ -439,35 +454,102 @@ class HtmlMinifier(object):
 	def close(self):
 		return ''
 
-	def minify(self, htmltext, options=None):
-		# Set the new options.
-		if options is not None: self.opts = dict(self.opts, options)
-
-		# Verify htmltext
-		if htmltext is None or len(htmltext) == 0:
-			raise ValueError('Invalid value specified for parameter: htmltext. Must be a string larger than 0 characters.')
+	def __pushBuffer(self):
+		""" Move the contents of the buffer into our results. """
+		for c in self.__buffer:
+			self.__results.append(c)
+			self.__resultsSize += len(c)
+		self.__buffer = []
 
-		# Reset the buffers.
+	def __flushResults(self):
+		""" Trim the pending results and write them out to the sink. Each
+		fragment is trimmed on its own, so writing them out in pieces gives
+		the same output as joining them all at the end. """
+		if len(self.__results):
+			self.__sink.write(self.__trimResults(self.__results))
+		self.__results = []
+		self.__resultsSize = 0
+
+	def __reset(self, sink=None, maxBuffer=None):
+		""" Reset the buffers before a new minification. """
+		self.__results = []
+		self.__resultsSize = 0
 		self.__buffer = []
 		self.__stackNoTrimWhitespace = []
 		self.__stackNoCollapseWhitespace = []
-		self.__currentChars = ''
+		self.__currentChars = []
 		self.__currentTag = ''
 		self.__currentAttrs = None
+		self.__depth = 0
+		self.__sink = sink
+		if maxBuffer is not None:
+			self.__maxBuffer = maxBuffer
 
 		# Until I can figure out how to access the actual doctype string when
 		# using a custom parser..
 		self.__doctype('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">')
+
+	def minify(self, htmltext, options=None):
+		# Set the new options.
+		if options is not None: self.opts = dict(self.opts, **options)
+
+		# Verify htmltext
+		if htmltext is None or len(htmltext) == 0:
+			raise ValueError('Invalid value specified for parameter: htmltext. Must be a string larger than 0 characters.')
+
+		self.__reset()
 		p = etree.HTMLParser(target = self)
 		tree = etree.fromstring(htmltext, parser=p)
 
 		# Iterate and add buffer to results.
-		for c in self.__buffer: self.__results.append(c)
-		self.__buffer = []
+		self.__pushBuffer()
+		results = self.__trimResults(self.__results)
+		self.__results = []
+		self.__resultsSize = 0
+		return results
 
-		# Trim the remainder of the results.
+	def minify_stream(self, infile, outfile, options=None, chunk_size=65536, max_buffer=1 << 20):
+		"""
+		Low-memory version of minify. Reads the html from infile in chunks of
+		chunk_size and writes the minified output to outfile as it goes, so
+		the whole document never has to sit in memory at once. Completed
+		top-level subtrees are written out as soon as they're closed, and
+		completed output is flushed once it reaches max_buffer characters.
+
+		The cap only covers completed output. An element's text is always
+		held whole until the element closes, since inline scripts and styles
+		have to be minified in one piece. A single huge text node, (a big
+		<pre> or inline <script> block, for example) will sit in memory in
+		full no matter what max_buffer is set to.
+		"""
+		if options is not None: self.opts = dict(self.opts, **options)
+
+		if chunk_size <= 0 or max_buffer <= 0:
+			raise ValueError('chunk_size and max_buffer must both be larger than 0.')
+
+		self.__reset(outfile, max_buffer)
+		try:
+			# huge_tree lifts libxml2's limits on text node size and depth,
+			# which gigabyte-sized documents can run into.
+			p = etree.HTMLParser(target = self, huge_tree = True)
+			while True:
+				chunk = infile.read(chunk_size)
+				if not chunk: break
+				p.feed(chunk)
+			p.close()
+
+			self.__pushBuffer()
+			self.__flushResults()
+		finally:
+			self.__sink = None
+			self.__results = []
+			self.__resultsSize = 0
+
+	def __trimResults(self, fragments):
+		""" Trim the whitespace around each of the fragments and join them
+		into a single string. """
 		results = []
-		for c in self.__results:
+		for c in fragments:
 			if re.search(r"[^\s\r\n]", c):
 				if re.search(r"^(?:[\s\r\n]+([\s]))", c):
 					c = re.sub(r"^(?:[\s\r\n]+([\s]))", r"\1", c)
@@ -481,27 +563,97 @@ class HtmlMinifier(object):
 		results = ''.join(results)
 		return results
 
-if __name__ == '__main__':
-	import sys
-	
-	if len(sys.argv) > 1:
+def minify_file(inpath, outfile, lowmem=False):
+	""" Minify the file at inpath and write the results to outfile. """
+	htmlfile = open(inpath, 'rt')
+	if lowmem:
+		# Minify code straight into the output
+		HtmlMinifier().minify_stream(htmlfile, outfile)
+		htmlfile.close()
+	else:
 		# Read input
-		htmlfile = open(sys.argv[1], 'rt')
 		htmlcode = htmlfile.read()
 		htmlfile.close()
 		
 		# Minify code
 		htmlmin = HtmlMinifier(htmlcode)
 		
+		# Write contents
+		outfile.write(htmlmin.minified)
+
+def watch(inpath, outpath, lowmem=False, interval=0.05):
+	""" Minify inpath into outpath, then poll inpath and minify it again
+	every time it changes. Each run writes to a temp file that's only moved
+	over outpath on success, so a bad save won't clobber the last good output. """
+	import os, time, tempfile
+	
+	outdir = os.path.dirname(os.path.abspath(outpath))
+	
+	# mkstemp creates files readable only by us. Give the output the same
+	# permissions a plain open() would have.
+	umask = os.umask(0)
+	os.umask(umask)
+	sig = None
+	print 'Watching %s for changes. Press Ctrl+C to stop.' % inpath
+	try:
+		while True:
+			# Go by size as well as mtime. Two saves within the same mtime
+			# tick (up to a couple of seconds on some filesystems) would
+			# otherwise look identical.
+			try:
+				st = os.stat(inpath)
+				current = (st.st_mtime, st.st_size)
+			except OSError:
+				current = None
+			
+			if current is not None and current != sig:
+				sig = current
+				start = time.time()
+				fd, temppath = tempfile.mkstemp(dir=outdir)
+				os.chmod(temppath, 0666 & ~umask)
+				outfile = os.fdopen(fd, 'w')
+				try:
+					try:
+						minify_file(inpath, outfile, lowmem)
+					finally:
+						outfile.close()
+					# Windows won't rename over an existing file.
+					if os.name == 'nt' and os.path.exists(outpath):
+						os.remove(outpath)
+					os.rename(temppath, outpath)
+				except Exception, e:
+					print 'Failed to minify %s: %s' % (inpath, e)
+					if os.path.exists(temppath): os.remove(temppath)
+				else:
+					print 'Minified %s in %dms' % (inpath, (time.time() - start) * 1000)
+			time.sleep(interval)
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == '__main__':
+	import sys
+	
+	# --low-memory streams the input through minify_stream rather than
+	# reading the whole thing in at once. --watch keeps running, minifying
+	# the input again whenever it changes.
+	args = sys.argv[1:]
+	lowmem = '--low-memory' in args
+	if lowmem: args.remove('--low-memory')
+	watching = '--watch' in args
+	if watching: args.remove('--watch')
+	
+	if watching and len(args) == 2:
+		watch(args[0], args[1], lowmem)
+	elif not watching and len(args) > 0:
 		# Figure out the output
 		outfile = None
-		if len(sys.argv) > 2:
-			outfile = open(sys.argv[2], 'w')
+		if len(args) > 1:
+			outfile = open(args[1], 'w')
 		else:
 			outfile = sys.stdout
 		
-		# Write contents and close
-		outfile.write(htmlmin.minified)
+		minify_file(args[0], outfile, lowmem)
 		outfile.close()
 	else:
-		print 'Usage: %s input [output]' % sys.argv[0]
+		print 'Usage: %s [--low-memory] [--watch] input [output]' % sys.argv[0]
+		if watching: print 'An output file is required when using --watch.'
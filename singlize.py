@@ -2,13 +2,84 @@
 from pyquery import PyQuery as pq
 import htmlminifier as html
 import cssmin as css
-from os import path, getcwd
-import sys, re, mimetypes, base64
+from os import path, getcwd, stat
+import sys, re, time, mimetypes, base64
 
 
 __author__ = 'Charles Grunwald <cgrunwald@gmail.com>'
 __root__ = getcwd()
 
+# Minified output for each script and stylesheet, keyed on (kind, path) for
+# linked files and (kind, contents) for inline ones. Each entry is stored as
+# (result, deps), where deps are the files that went into it. (see file_sig)
+__minified__ = {}
+
+# The files read by the current build (path -> file_sig) and the keys into
+# __minified__ it used.
+__build_deps__ = {}
+__build_keys__ = set()
+
+# Dicts collecting the files read by the minify_cached calls in progress.
+__reading__ = []
+
+def file_sig(url):
+	"""
+	Stat signature used to tell whether a file has changed, or None if it
+	doesn't exist. The size is in there because two saves within the same
+	mtime tick (which can be a whole second or two on some filesystems)
+	would otherwise look identical.
+	"""
+	try:
+		st = stat(url)
+	except OSError:
+		return None
+	return (st.st_mtime, st.st_size)
+
+def add_dep(url, sig):
+	__build_deps__[url] = sig
+	for deps in __reading__:
+		deps[url] = sig
+
+def read_asset(url):
+	"""
+	Read url and record it as a dependency of the current build.
+	"""
+	# Record it before reading it, so a file that doesn't exist yet still
+	# gets watched when the read fails.
+	add_dep(url, file_sig(url))
+	f = open(url, 'rb')
+	content = f.read()
+	f.close()
+	return content
+
+def minify_cached(kind, key, process):
+	"""
+	Return the cached result for (kind, key) if none of the files that went
+	into it have changed. Otherwise call process() to make a new one.
+	"""
+	key = (kind, key)
+	__build_keys__.add(key)
+	cached = __minified__.get(key)
+	if cached is not None:
+		result, deps = cached
+		if all(file_sig(url) == sig for url, sig in deps.items()):
+			for url, sig in deps.items():
+				add_dep(url, sig)
+			return result
+
+	deps = {}
+	__reading__.append(deps)
+	try:
+		result = process()
+	finally:
+		__reading__.pop()
+
+	# Don't hang on to errors, (like the Closure Compiler's "Error(...)"
+	# responses) or the next build would never try again.
+	if not result.startswith('Error(') and not html.HtmlMinifier.reBlank.match(result):
+		__minified__[key] = (result, deps)
+	return result
+
 def data_encode_image(name,content):
 	return u'data:%s;base64,%s' % (mimetypes.guess_type(name)[0],base64.standard_b64encode(content))
 
@@ -26,41 +97,15 @@ def inline(element):
 	"""
 	return pq(element).text()
 
-def minify_js(js_code=None, js_url=None):
-	""" Compile js_code using the Google Closure Compiler service
-	found at http://closure-compiler.appspot.com """
-	
-	# Param presets
-	params = {
-		'output_format': 'text',
-		'output_info': 'compiled_code',
-		'compilation_level': 'SIMPLE_OPTIMIZATIONS',
-	}
-	
-	# Figure out if we're using a url or the js source itself
-	if js_code is not None:
-		params['js_code'] = js_code
-	elif js_url is not None:
-		params['code_url'] = js_url
-	else:
-		raise ValueError('Must specify a value for either js_code or js_url')
-	# Always use the following value for the Content-type header.
-	headers = { 'Content-type': 'application/x-www-form-urlencoded' }
-	connection = HTTPConnection('closure-compiler.appspot.com')
-	connection.request('POST', '/compile', urlencode(params), headers)
-	response = connection.getresponse()
-	data = response.read()
-	connection.close()
-	return data
-
 def process_js(filedir, scripts):
 	if not len(scripts): return None
-	result = ''
+	results = []
 	for script in scripts:
 		src = script.get('src')
 		if src is None or len(src) == 0:
 			print 'Found inline-script. Processing..'
-			result += inline(script)
+			code = inline(script)
+			results.append(minify_cached('js', code, lambda: html.HtmlMinifier.jsmin(code)))
 		else:
 			match = re.search("^((?:file://)|(?:https?://)|(?:chrome://))", src)
 			if match:
@@ -71,12 +116,15 @@ def process_js(filedir, scripts):
 				url = resolve_url(filedir, src)
 				if not path.exists(url):
 					print 'Script %s (resolved from %s) did not exist. Skipping..' % (url, src)
+					add_dep(url, None)
 				else:
 					print 'Script: %s' % url
-					result += open(url).read()
-	if not len(result): return None
-	
-	result = minify_js(result).strip('\r\n \t')
+					results.append(minify_cached('js', url, lambda: html.HtmlMinifier.jsmin(read_asset(url))))
+
+	# Each script was minified on its own, so keep a ; between them in case
+	# one of them leaves its last statement open.
+	results = [result.strip('\r\n \t') for result in results]
+	result = ';\n'.join(result for result in results if len(result))
 	if not len(result): return None
 	return result
 
@@ -98,17 +146,21 @@ def process_css_internals(basedir, filedir, content):
 				# Image
 				url = resolve_url(filedir, urlMatch)
 				#replacement = u'url(%s)' % data_encode_image(path, open(url, 'rb').read())
-				data =  data_encode_image(url, open(url, 'rb').read())
+				data =  data_encode_image(url, read_asset(url))
 				content = content.replace(urlMatch, data)
 
 	#__target_stylesheets__
 	return content
 
+def minify_css(basedir, filedir, content):
+	content = str(re.sub('[\r\n]', "", process_css_internals(basedir, filedir, content))).strip()
+	if not len(content): return ''
+	return css.cssmin(content)
 
 def process_css(filedir, styles, links):
 	processed = []
 	__target_stylesheets__.extend(links)
-	result = ''
+	results = []
 	if len(links) > 0:
 		current = 0
 		while current < len(__target_stylesheets__):
@@ -123,11 +175,12 @@ def process_css(filedir, styles, links):
 				url = resolve_url(filedir, link)
 				if not path.exists(url):
 					print 'Stylesheet %s (resolved from %s) did not exist. Skipping..' % (url, link)
+					add_dep(url, None)
 				else:
 					if not url in processed:
 						print 'Adding stylesheet: %s' % url
-						contents = open(url).read()
-						result += process_css_internals(filedir, path.abspath(path.dirname(url)), contents)
+						sheetdir = path.abspath(path.dirname(url))
+						results.append(minify_cached('css', url, lambda: minify_css(filedir, sheetdir, read_asset(url))))
 						processed.append(url)
 					else:
 						print '%s already processed.. Skipping.'
@@ -135,31 +188,27 @@ def process_css(filedir, styles, links):
 	if len(styles) > 0:
 		for style in styles:
 			print 'Found inline-style. Processing..'
-			result += process_css_internals(filedir, filedir, inline(style))
-
+			code = inline(style)
+			# Any url()s in it are relative to the page, so the page's
+			# directory is part of the key too.
+			results.append(minify_cached('css', (filedir, code), lambda: minify_css(filedir, filedir, code)))
 
-	result = str(re.sub('[\r\n]', "", result)).strip()
+	result = ''.join(results)
 	if not len(result): return None
-	return css.cssmin(result)
-
-def main(argv=None):
-	if argv is None:
-		argv = sys.argv
-
-	if len(argv) != 3:
-		print 'Usage: %s file.html output.html\n' % argv[0]
-		exit(1)
-
-	target = path.abspath(argv[1])
-	if not path.exists(target):
-		print '%s does not exist.' % target
-		exit(1)
+	return result
 
-	output = path.abspath(argv[2])
+def build(target, output):
+	"""
+	Singlize target into output. Returns the files the build depended on
+	and the keys into __minified__ it used, as (deps, keys).
+	"""
+	del __target_stylesheets__[:]
+	__build_deps__.clear()
+	__build_keys__.clear()
 
 	# Get directory of file, then read it into pyquery.
 	filedir = path.abspath(path.dirname(target))
-	content = open(target).read()
+	content = read_asset(target)
 	d = pq(content)
 
 	# Get all scripts and stylesheets
@@ -178,10 +227,113 @@ def main(argv=None):
 		styles = '<style type="text/css">%s</style></head>' % styles
 		content = content.replace('</head>', styles)
 	print 'Minimizing HTML..'
-	content = html.HtmlMinifier(value=content).minified
+	# Every script and stylesheet has already been minified above.
+	content = html.HtmlMinifier(content, {'minifyJS': False, 'minifyCSS': False}).minified
 	f = open(output, 'w')
 	f.write(content)
 	f.close()
+	return dict(__build_deps__), set(__build_keys__)
+
+def try_build(target, output, deps=None, keys=None):
+	"""
+	Like build, but failures are reported instead of raised, and a third
+	value is returned saying whether the build succeeded. When it fails,
+	the deps returned are the previous deps plus whatever the failed build
+	read before it broke, so fixing any of them will trigger another build.
+	"""
+	try:
+		return build(target, output) + (True,)
+	except Exception, e:
+		print 'Failed to build %s: %s' % (output, e)
+
+		# Refresh the old signatures so the same change doesn't set off
+		# another build straight away.
+		failed = { target: file_sig(target) }
+		for url in (deps or {}):
+			failed[url] = file_sig(url)
+		failed.update(__build_deps__)
+		return failed, set(keys or ()) | __build_keys__, False
+
+def build_all(pairs):
+	"""
+	Build each (target, output) pair, and return the dependency graph
+	used by rebuild_changed: output -> (target, deps, keys).
+	"""
+	graph = {}
+	for target, output in pairs:
+		deps, keys, ok = try_build(target, output)
+		graph[output] = (target, deps, keys)
+	return graph
+
+def rebuild_changed(graph):
+	"""
+	Rebuild the outputs in graph that depend on a file that changed since
+	their last build. Returns the outputs that were successfully rebuilt.
+	"""
+	sigs = {}
+	rebuilt = []
+	for output, (target, deps, keys) in graph.items():
+		for url in deps:
+			if url not in sigs:
+				sigs[url] = file_sig(url)
+		changed = [url for url in deps if sigs[url] != deps[url]]
+		if not len(changed): continue
+
+		print '%s changed. Rebuilding %s..' % (', '.join(changed), output)
+		start = time.time()
+		deps, keys, ok = try_build(target, output, deps, keys)
+		graph[output] = (target, deps, keys)
+		if not ok: continue
+		print 'Rebuilt %s in %dms' % (output, (time.time() - start) * 1000)
+		rebuilt.append(output)
+
+	if len(rebuilt):
+		# Drop the minified output no page uses anymore.
+		keys = set()
+		for target, outdeps, outkeys in graph.values():
+			keys.update(outkeys)
+		for key in __minified__.keys():
+			if key not in keys: del __minified__[key]
+	return rebuilt
+
+def watch(pairs, interval=0.05):
+	"""
+	Build each (target, output) pair, then poll every file they depend on
+	and rebuild only the outputs affected by a change.
+	"""
+	graph = build_all(pairs)
+	print 'Watching for changes. Press Ctrl+C to stop.'
+	try:
+		while True:
+			time.sleep(interval)
+			rebuild_changed(graph)
+	except KeyboardInterrupt:
+		pass
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv
+
+	args = argv[1:]
+	watching = '--watch' in args
+	if watching: args.remove('--watch')
+
+	if len(args) < 2 or len(args) % 2 or (len(args) > 2 and not watching):
+		print 'Usage: %s [--watch] file.html output.html [file2.html output2.html ...]\n' % argv[0]
+		exit(1)
+
+	pairs = []
+	for i in range(0, len(args), 2):
+		target = path.abspath(args[i])
+		if not path.exists(target):
+			print '%s does not exist.' % target
+			exit(1)
+		pairs.append((target, path.abspath(args[i + 1])))
+
+	if watching:
+		watch(pairs)
+	else:
+		build(*pairs[0])
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compare the peak memory use of HtmlMinifier.minify and
+HtmlMinifier.minify_stream on a big generated document. Each one runs
+in its own process so neither skews the other's numbers.
+
+Usage: stream_bench.py [size_in_mb]
+"""
+import os, sys, time, filecmp, resource, tempfile, subprocess
+
+# JS minification may go out to the Closure Compiler service, so leave
+# it off. Nothing here needs it.
+OPTIONS = { 'minifyJS': False }
+
+ROW = '<tr class="row  r%d"><td>  %d  </td><td title=" cell ">  some   report   text  </td><td><a href=" /x/%d ">link</a></td></tr>\n'
+
+def generate(outfile, size):
+	""" Write a report-ish document of roughly size bytes to outfile. """
+	outfile.write('<!DOCTYPE html>\n<html>\n<head><title> Report </title></head>\n<body>\n')
+	written, i = 0, 0
+	while written < size:
+		# Break the rows up into separate top-level tables so that
+		# minify_stream has somewhere to flush.
+		chunk = '<table><tbody>\n%s</tbody></table>\n' % ''.join(ROW % (n, n, n) for n in range(i, i + 1000))
+		outfile.write(chunk)
+		written += len(chunk)
+		i += 1000
+	outfile.write('</body>\n</html>\n')
+
+def peak_rss():
+	""" Peak resident set size of this process, in kB. (ru_maxrss is
+	already kB on Linux, but bytes on OS X) """
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss / 1024 if sys.platform == 'darwin' else rss
+
+def run(mode, inpath, outpath):
+	""" Minify inpath into outpath with one of the two modes, then print
+	out the time it took and our peak memory use. """
+	from htmlminifier import HtmlMinifier
+	start = time.time()
+	infile = open(inpath, 'rt')
+	outfile = open(outpath, 'w')
+	if mode == 'stream':
+		HtmlMinifier(options=OPTIONS).minify_stream(infile, outfile)
+	else:
+		outfile.write(HtmlMinifier(options=OPTIONS).minify(infile.read()))
+	infile.close()
+	outfile.close()
+	print '%.2f %d' % (time.time() - start, peak_rss())
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv
+
+	if len(argv) == 5 and argv[1] == '--run':
+		run(*argv[2:])
+		return 0
+
+	size = int(argv[1]) if len(argv) > 1 else 20
+	workdir = tempfile.mkdtemp()
+	inpath = os.path.join(workdir, 'input.html')
+	try:
+		infile = open(inpath, 'w')
+		generate(infile, size << 20)
+		infile.close()
+		print 'Input: %.1fMB' % (os.path.getsize(inpath) / 1048576.0)
+
+		for mode in ('minify', 'stream'):
+			outpath = os.path.join(workdir, mode + '.html')
+			proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', mode, inpath, outpath], stdout=subprocess.PIPE)
+			output = proc.communicate()[0]
+			if proc.returncode != 0:
+				print '%s run failed.' % mode
+				return 1
+			seconds, rss = output.split()
+			print '%-7s %6.2fs  peak RSS %8dkB' % (mode, float(seconds), int(rss))
+
+		paths = [os.path.join(workdir, mode + '.html') for mode in ('minify', 'stream')]
+		if not filecmp.cmp(paths[0], paths[1], shallow=False):
+			print 'minify and minify_stream gave different output.'
+			return 1
+		return 0
+	finally:
+		for name in os.listdir(workdir):
+			os.remove(os.path.join(workdir, name))
+		os.rmdir(workdir)
+
+if __name__ == '__main__':
+	sys.exit(main())
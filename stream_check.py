@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Quick check that HtmlMinifier.minify_stream writes out exactly what
+HtmlMinifier.minify returns, no matter where the flushes land.
+
+Usage: stream_check.py
+"""
+import sys
+from StringIO import StringIO
+from htmlminifier import HtmlMinifier
+
+# JS minification may go out to the Closure Compiler service, so leave
+# it off. Nothing here needs it.
+OPTIONS = { 'minifyJS': False }
+
+SAMPLE = """<!DOCTYPE html>
+<html>
+  <head>
+    <title>  Report   dump </title>
+    <style type="text/css">
+      <!--
+      .row   { color: red; }
+      -->
+    </style>
+  </head>
+  <body>
+    %s
+    <pre>
+  keep    this
+      as is  </pre>
+    <table><tbody><tr><td> last </td></tr></tbody></table>
+    <div><select>%s</select></div>
+  </body>
+</html>
+""" % ('\n    '.join(
+	'<div class="row  r%d"><p title="  x ">  item   %d  </p><br><span> a </span> <!-- c --></div>' % (i, i)
+	for i in range(500)
+), ''.join(
+	# Optional tags, so none of these close on their own.
+	'<option value="%d"> choice %d </option>' % (i, i) for i in range(2000)
+))
+
+class CountingSink(object):
+	""" Collects everything written to it and counts the writes. """
+	def __init__(self):
+		self.parts = []
+
+	def write(self, data):
+		self.parts.append(data)
+
+def check(expected, max_buffer, chunk_size):
+	sink = CountingSink()
+	HtmlMinifier(options=OPTIONS).minify_stream(StringIO(SAMPLE), sink, chunk_size=chunk_size, max_buffer=max_buffer)
+	result = ''.join(sink.parts)
+	largest = max(len(part) for part in sink.parts)
+	ok = result == expected and len(sink.parts) > 1
+
+	# Nothing in the sample is anywhere near 1k on its own, so with a small
+	# cap no single write should get much bigger than the cap.
+	if max_buffer < 1024 and largest > max_buffer + 1024:
+		ok = False
+	print '%s max_buffer=%d chunk_size=%d: %d writes, %d chars, largest write %d' % ('ok  ' if ok else 'FAIL', max_buffer, chunk_size, len(sink.parts), len(result), largest)
+	return ok
+
+def main():
+	expected = HtmlMinifier(options=OPTIONS).minify(SAMPLE)
+
+	# A huge max_buffer means only the top-level subtree flushes kick in,
+	# a tiny one flushes after nearly every element.
+	ok = True
+	for max_buffer, chunk_size in [(1 << 30, 4096), (256, 101), (1, 7)]:
+		ok = check(expected, max_buffer, chunk_size) and ok
+
+	# minify shouldn't pick up anything left over from earlier runs.
+	minifier = HtmlMinifier(options=OPTIONS)
+	minifier.minify(SAMPLE)
+	if minifier.minify(SAMPLE) != expected:
+		print 'FAIL repeated minify calls gave different results'
+		ok = False
+
+	return 0 if ok else 1
+
+if __name__ == '__main__':
+	sys.exit(main())
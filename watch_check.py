@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Quick check of singlize's watch mode: that only the pages depending on
+a changed file get rebuilt, that unchanged scripts and stylesheets come
+out of the cache, and that linked files are still watched after being
+deleted.
+
+Usage: watch_check.py
+"""
+import os, sys, shutil, tempfile
+from StringIO import StringIO
+import singlize
+import htmlminifier as html
+
+PAGE = """<html>
+<head><link rel="stylesheet" href="shared.css" /></head>
+<body><p>%s</p><script src="%s"></script></body>
+</html>
+"""
+
+# Count the calls to the minifiers. The JS one is stubbed out so nothing
+# goes over the network.
+calls = { 'js': [], 'css': [] }
+
+def fake_jsmin(js_code=None, js_url=None):
+	calls['js'].append(js_code)
+	return js_code.strip()
+
+real_cssmin = singlize.css.cssmin
+def counting_cssmin(css_code):
+	calls['css'].append(css_code)
+	return real_cssmin(css_code)
+
+def write(name, content):
+	f = open(name, 'w')
+	f.write(content)
+	f.close()
+
+def read(name):
+	f = open(name)
+	content = f.read()
+	f.close()
+	return content
+
+def quietly(func, *args):
+	""" singlize prints a running commentary. Keep it out of our output. """
+	stdout = sys.stdout
+	sys.stdout = StringIO()
+	try:
+		return func(*args)
+	finally:
+		sys.stdout = stdout
+
+def main():
+	html.HtmlMinifier.jsmin = staticmethod(fake_jsmin)
+	singlize.css.cssmin = counting_cssmin
+
+	workdir = tempfile.mkdtemp()
+	failures = []
+	def check(ok, what):
+		print '%s %s' % ('ok  ' if ok else 'FAIL', what)
+		if not ok: failures.append(what)
+
+	try:
+		os.chdir(workdir)
+		write('shared.css', 'p { color : red ; }')
+		write('a.js', 'var a = 1')
+		write('b.js', 'var b = 1')
+		write('a.html', PAGE % ('a', 'a.js'))
+		write('b.html', PAGE % ('b', 'b.js'))
+		pages = [(os.path.join(workdir, name + '.html'), os.path.join(workdir, name + '.out.html')) for name in 'ab']
+		outa, outb = pages[0][1], pages[1][1]
+		sheet = os.path.join(workdir, 'shared.css')
+
+		graph = quietly(singlize.build_all, pages)
+		check('var a = 1' in read(outa) and 'var b = 1' in read(outb), 'both pages built')
+		check(len(calls['css']) == 1, 'shared stylesheet minified once for both pages')
+		check(quietly(singlize.rebuild_changed, graph) == [], 'nothing rebuilt without changes')
+
+		# Same mtime tick or not, the size change gives it away.
+		del calls['js'][:], calls['css'][:]
+		write('a.js', 'var a = 12345')
+		rebuilt = quietly(singlize.rebuild_changed, graph)
+		check(rebuilt == [outa], 'only the page using a.js rebuilt (%r)' % rebuilt)
+		check('var a = 12345' in read(outa), 'page picked up the new a.js')
+		check(calls['js'] == ['var a = 12345'], 'only a.js minified again (%r)' % calls['js'])
+		check(calls['css'] == [] and ('css', sheet) in singlize.__minified__, 'shared stylesheet served from the cache')
+
+		os.remove('b.js')
+		rebuilt = quietly(singlize.rebuild_changed, graph)
+		check(rebuilt == [outb] and 'var b' not in read(outb), 'deleting b.js rebuilt its page')
+		check(('js', os.path.join(workdir, 'b.js')) not in singlize.__minified__, 'b.js dropped from the cache')
+
+		write('b.js', 'var b = 2')
+		rebuilt = quietly(singlize.rebuild_changed, graph)
+		check(rebuilt == [outb] and 'var b = 2' in read(outb), 'recreating b.js rebuilt its page')
+	finally:
+		os.chdir(singlize.__root__)
+		shutil.rmtree(workdir)
+
+	return 1 if len(failures) else 0
+
+if __name__ == '__main__':
+	sys.exit(main())